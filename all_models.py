@@ -281,6 +281,7 @@ class RFI(Base):
         return f"<RFI {self.nombre}>"
 
 
+# Particionada por mes sobre ``fecha`` en PostgreSQL (ver particiones.py)
 class EstadoRFI(Base):
     __tablename__ = "estados_rfi"
 
@@ -299,6 +300,7 @@ class EstadoRFI(Base):
         return f"<EstadoRFI {self.estado} #{self.rfi_id}>"
 
 
+# Particionada por mes sobre ``fecha`` en PostgreSQL (ver particiones.py)
 class ResultadoBusqueda(Base):
     __tablename__ = "resultados_busquedas"
 
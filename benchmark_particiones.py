@@ -0,0 +1,90 @@
+"""Benchmark de poda de particiones en consultas acotadas por fecha.
+
+Uso: python benchmark_particiones.py <vt_id> [dias]
+
+Compara, para ``resultados_busquedas`` y ``estados_rfi``, la consulta de los
+últimos ``dias`` días frente a la misma consulta sin límite temporal: tiempo
+de ejecución y particiones realmente recorridas según EXPLAIN ANALYZE.
+"""
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Set
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from all_models import RFI, EstadoRFI, ResultadoBusqueda
+from particiones import listar_particiones
+
+
+def _consultas(vt_id: int, desde: datetime) -> Dict[str, Dict[str, Any]]:
+    resultados = select(ResultadoBusqueda).where(ResultadoBusqueda.vt_id == vt_id)
+    estados = (
+        select(EstadoRFI)
+        .join(RFI, RFI.id == EstadoRFI.rfi_id)
+        .where(RFI.vt_id == vt_id)
+    )
+    return {
+        "resultados_busquedas": {
+            "acotada": resultados.where(ResultadoBusqueda.fecha >= desde),
+            "completa": resultados,
+        },
+        "estados_rfi": {
+            "acotada": estados.where(EstadoRFI.fecha >= desde),
+            "completa": estados,
+        },
+    }
+
+
+def _relaciones(nodo: Dict[str, Any]) -> Set[str]:
+    """Tablas recorridas por el plan (nodos no ejecutados se descartan)"""
+    nombres = set()
+    if "Relation Name" in nodo and nodo.get("Actual Loops", 1) > 0:
+        nombres.add(nodo["Relation Name"])
+    for hijo in nodo.get("Plans", []):
+        nombres |= _relaciones(hijo)
+    return nombres
+
+
+def explicar(db, stmt) -> Dict[str, Any]:
+    conn = db.connection()
+    # Compilar con el dialecto de la conexión: el formato de parámetros
+    # depende del driver (psycopg2, psycopg, ...)
+    compilada = stmt.compile(dialect=conn.dialect)
+    if compilada.positional:
+        parametros = tuple(compilada.params[nombre] for nombre in compilada.positiontup)
+    else:
+        parametros = compilada.params
+    plan = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, FORMAT JSON) {compilada}", parametros).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    plan = plan[0]
+    return {
+        "ms": plan["Execution Time"],
+        "particiones": _relaciones(plan["Plan"]),
+    }
+
+
+def main(vt_id: int, dias: int = 90) -> None:
+    desde = datetime.now(timezone.utc) - timedelta(days=dias)
+    with SessionLocal() as db:
+        for tabla, variantes in _consultas(vt_id, desde).items():
+            total = len(listar_particiones(db.connection(), tabla))
+            print(f"{tabla} ({total} particiones)")
+            for nombre, stmt in variantes.items():
+                medida = explicar(db, stmt)
+                recorridas = sorted(
+                    p for p in medida["particiones"] if p.startswith(f"{tabla}_")
+                )
+                print(
+                    f"  {nombre:<9} {medida['ms']:9.2f} ms"
+                    f"  recorre {len(recorridas)}/{total}: {', '.join(recorridas)}"
+                )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(int(sys.argv[1]), int(sys.argv[2]) if len(sys.argv) > 2 else 90)
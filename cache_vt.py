@@ -0,0 +1,533 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from all_models import (
+    VT,
+    RFI,
+    Contacto,
+    ContactoVT,
+    EstadoRFI,
+    Proveedor,
+    ResultadoBusqueda,
+    TechServicio,
+    TechVT,
+)
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configuración de la caché
+VT_CACHE_MAXSIZE = int(os.getenv("VT_CACHE_MAXSIZE", "1024"))
+VT_CACHE_TTL = float(os.getenv("VT_CACHE_TTL", "60"))
+VT_CACHE_PATH = os.getenv("VT_CACHE_PATH", "")
+# Espera máxima por el bloqueo del almacén compartido antes de ignorarlo
+VT_CACHE_TIMEOUT = float(os.getenv("VT_CACHE_TIMEOUT", "0.5"))
+
+logger = logging.getLogger(__name__)
+
+# --- Agregados cacheados y tablas de las que dependen ------------------------ #
+AGREGADO_TECHS = "techs"
+AGREGADO_RFIS_POR_ESTADO = "rfis_por_estado"
+AGREGADO_PROVEEDORES = "proveedores"
+AGREGADO_CONTACTOS = "contactos"
+
+AGREGADOS = (
+    AGREGADO_TECHS,
+    AGREGADO_RFIS_POR_ESTADO,
+    AGREGADO_PROVEEDORES,
+    AGREGADO_CONTACTOS,
+)
+
+# Una escritura en la tabla invalida sólo los agregados que la leen
+DEPENDENCIAS = {
+    TechVT.__tablename__: (AGREGADO_TECHS,),
+    RFI.__tablename__: (AGREGADO_RFIS_POR_ESTADO,),
+    EstadoRFI.__tablename__: (AGREGADO_RFIS_POR_ESTADO,),
+    ResultadoBusqueda.__tablename__: (AGREGADO_PROVEEDORES,),
+    ContactoVT.__tablename__: (AGREGADO_CONTACTOS,),
+    VT.__tablename__: AGREGADOS,
+    # Tablas padre: borrarlas elimina filas hijas por ON DELETE CASCADE en la
+    # BD, que nunca pasan por session.deleted
+    Proveedor.__tablename__: (
+        AGREGADO_RFIS_POR_ESTADO,
+        AGREGADO_PROVEEDORES,
+        AGREGADO_CONTACTOS,
+    ),
+    TechServicio.__tablename__: (AGREGADO_TECHS, AGREGADO_PROVEEDORES),
+    Contacto.__tablename__: (AGREGADO_CONTACTOS,),
+}
+
+# Sus filas no llevan vt_id: su borrado invalida los agregados de todas las VT
+PADRES = (Proveedor, TechServicio, Contacto)
+
+SIN_ESTADO = "sin_estado"
+
+_CLAVE_PENDIENTES = "cache_vt_pendientes"
+_CLAVE_FLUSH = "cache_vt_flush"
+
+# vt_id = None significa "todas las VT" (p. ej. tras un UPDATE/DELETE masivo)
+Clave = Tuple[Optional[int], str]
+
+
+# =========================  CONSULTAS AGREGADAS  =========================== #
+def contar_techs(db: Session, vt_id: int) -> int:
+    """Número de tecnologías asociadas a la VT"""
+    stmt = select(func.count(TechVT.id)).where(TechVT.vt_id == vt_id)
+    return db.execute(stmt).scalar_one()
+
+
+def contar_rfis_por_estado(db: Session, vt_id: int) -> Dict[str, int]:
+    """Número de RFIs de la VT agrupadas por su estado más reciente"""
+    ultimo = (
+        select(
+            EstadoRFI.rfi_id,
+            EstadoRFI.estado,
+            func.row_number()
+            .over(
+                partition_by=EstadoRFI.rfi_id,
+                order_by=(EstadoRFI.fecha.desc(), EstadoRFI.id.desc()),
+            )
+            .label("orden"),
+        )
+        .join(RFI, RFI.id == EstadoRFI.rfi_id)
+        .where(RFI.vt_id == vt_id)
+        .subquery()
+    )
+    stmt = (
+        select(ultimo.c.estado, func.count(RFI.id))
+        .select_from(RFI)
+        .outerjoin(ultimo, (ultimo.c.rfi_id == RFI.id) & (ultimo.c.orden == 1))
+        .where(RFI.vt_id == vt_id)
+        .group_by(ultimo.c.estado)
+    )
+    return {
+        (estado if estado is not None else SIN_ESTADO): total
+        for estado, total in db.execute(stmt)
+    }
+
+
+def contar_proveedores(db: Session, vt_id: int) -> int:
+    """Número de proveedores distintos encontrados en las búsquedas de la VT"""
+    stmt = select(func.count(func.distinct(ResultadoBusqueda.proveedor_id))).where(
+        ResultadoBusqueda.vt_id == vt_id
+    )
+    return db.execute(stmt).scalar_one()
+
+
+def contar_contactos(db: Session, vt_id: int) -> int:
+    """Número de contactos vinculados a la VT"""
+    stmt = select(func.count(ContactoVT.id)).where(ContactoVT.vt_id == vt_id)
+    return db.execute(stmt).scalar_one()
+
+
+CONSULTAS: Dict[str, Callable[[Session, int], Any]] = {
+    AGREGADO_TECHS: contar_techs,
+    AGREGADO_RFIS_POR_ESTADO: contar_rfis_por_estado,
+    AGREGADO_PROVEEDORES: contar_proveedores,
+    AGREGADO_CONTACTOS: contar_contactos,
+}
+
+
+# =========================  ALMACÉN COMPARTIDO  ============================ #
+class AlmacenCompartido:
+    """Almacén local en SQLite compartido entre procesos de la misma máquina.
+
+    Cada invalidación incrementa una versión global; una escritura sólo se
+    acepta si la versión no cambió desde que se empezó a consultar la BD, así
+    un proceso no puede republicar un valor anterior a un commit ya invalidado.
+    """
+
+    def __init__(self, ruta: str, timeout: float = VT_CACHE_TIMEOUT):
+        self.ruta = ruta
+        self.timeout = timeout
+        with self._conectar() as conn:
+            # WAL: las lecturas no esperan a las escrituras de otros procesos
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS agregados_vt ("
+                " vt_id INTEGER NOT NULL,"
+                " agregado TEXT NOT NULL,"
+                " valor TEXT NOT NULL,"
+                " expira REAL NOT NULL,"
+                " PRIMARY KEY (vt_id, agregado))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS version_agregados ("
+                " id INTEGER PRIMARY KEY CHECK (id = 0),"
+                " version INTEGER NOT NULL)"
+            )
+            conn.execute("INSERT OR IGNORE INTO version_agregados (id, version) VALUES (0, 0)")
+
+    @contextmanager
+    def _conectar(self) -> Iterator[sqlite3.Connection]:
+        with closing(sqlite3.connect(self.ruta, timeout=self.timeout)) as conn, conn:
+            yield conn
+
+    def version(self) -> int:
+        with self._conectar() as conn:
+            return conn.execute("SELECT version FROM version_agregados").fetchone()[0]
+
+    def obtener(self, vt_id: int, agregado: str) -> Tuple[bool, Any, float]:
+        """Devuelve (encontrado, valor, expira)"""
+        with self._conectar() as conn:
+            fila = conn.execute(
+                "SELECT valor, expira FROM agregados_vt WHERE vt_id = ? AND agregado = ?",
+                (vt_id, agregado),
+            ).fetchone()
+        if fila is None or fila[1] <= time.time():
+            return False, None, 0.0
+        return True, json.loads(fila[0]), fila[1]
+
+    def guardar(
+        self, vt_id: int, agregado: str, valor: Any, expira: float, version: int
+    ) -> bool:
+        """Guarda el valor si nadie invalidó desde ``version``"""
+        with self._conectar() as conn:
+            cursor = conn.execute(
+                "INSERT OR REPLACE INTO agregados_vt (vt_id, agregado, valor, expira)"
+                " SELECT ?, ?, ?, ? WHERE (SELECT version FROM version_agregados) = ?",
+                (vt_id, agregado, json.dumps(valor), expira, version),
+            )
+            return cursor.rowcount == 1
+
+    def invalidar(self, claves: Iterable[Clave]) -> None:
+        with self._conectar() as conn:
+            conn.execute("UPDATE version_agregados SET version = version + 1")
+            for vt_id, agregado in claves:
+                if vt_id is None:
+                    conn.execute("DELETE FROM agregados_vt WHERE agregado = ?", (agregado,))
+                else:
+                    conn.execute(
+                        "DELETE FROM agregados_vt WHERE vt_id = ? AND agregado = ?",
+                        (vt_id, agregado),
+                    )
+
+
+# =========================  CACHÉ DE AGREGADOS  ============================ #
+class CacheAgregadosVT:
+    """Caché read-through de agregados por VT (LRU con TTL en memoria,
+    opcionalmente respaldada por un almacén local compartido).
+
+    Las entradas se invalidan en ``after_commit`` según las tablas y VT que
+    tocó la transacción. Con almacén compartido, cada entrada en memoria
+    guarda la versión del almacén con la que se leyó y sólo se sirve si sigue
+    vigente, así los commits de otros procesos también la invalidan.
+
+    El almacén compartido es best-effort: sus errores se registran y la
+    lectura cae a la BD. Una invalidación que no llegó a escribirse se
+    reintenta en la siguiente operación y, mientras tanto, este proceso no
+    confía en el almacén.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = VT_CACHE_MAXSIZE,
+        ttl: float = VT_CACHE_TTL,
+        ruta_compartida: Optional[str] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.compartido = AlmacenCompartido(ruta_compartida) if ruta_compartida else None
+        # clave -> (expira, valor, versión del almacén compartido o None)
+        self._entradas: "OrderedDict[Tuple[int, str], Tuple[float, Any, Optional[int]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generacion = 0
+        self._sin_invalidar: Set[Clave] = set()
+
+    # --- lectura ---------------------------------------------------------- #
+    def obtener(self, db: Session, vt_id: int, agregado: str) -> Any:
+        """Devuelve el agregado de la VT, consultando la BD si no está en caché"""
+        clave = (vt_id, agregado)
+        pendientes = db.info.get(_CLAVE_PENDIENTES, ())
+        if clave in pendientes or (None, agregado) in pendientes:
+            # La sesión tiene escrituras sin confirmar que afectan al agregado:
+            # ni servir lo cacheado ni publicar lo que ella ve
+            return self._consultar(db, vt_id, agregado)
+
+        version = None
+        if self.compartido is not None:
+            version = self._version_compartida()
+            if version is None:
+                return self._consultar(db, vt_id, agregado)
+
+        ahora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                if entrada[0] > ahora and entrada[2] == version:
+                    self._entradas.move_to_end(clave)
+                    self.hits += 1
+                    return entrada[1]
+                del self._entradas[clave]
+
+        if self.compartido is not None:
+            try:
+                encontrado, valor, expira = self.compartido.obtener(vt_id, agregado)
+            except sqlite3.Error:
+                logger.warning("Almacén compartido no disponible al leer", exc_info=True)
+                return self._consultar(db, vt_id, agregado)
+            if encontrado:
+                with self._lock:
+                    self.hits += 1
+                    # Conservar la caducidad original, no renovarla
+                    self._guardar(clave, valor, expira, version)
+                return valor
+
+        with self._lock:
+            generacion = self._generacion
+        valor = self._consultar(db, vt_id, agregado)
+        expira = time.time() + self.ttl
+        with self._lock:
+            # Un commit concurrente pudo invalidar mientras se consultaba
+            if generacion != self._generacion:
+                return valor
+            self._guardar(clave, valor, expira, version)
+        if self.compartido is not None:
+            try:
+                self.compartido.guardar(vt_id, agregado, valor, expira, version)
+            except sqlite3.Error:
+                logger.warning("Almacén compartido no disponible al guardar", exc_info=True)
+        return valor
+
+    def _consultar(self, db: Session, vt_id: int, agregado: str) -> Any:
+        with self._lock:
+            self.misses += 1
+        return CONSULTAS[agregado](db, vt_id)
+
+    def _version_compartida(self) -> Optional[int]:
+        """Versión actual del almacén, o None si ahora no es fiable"""
+        if self._sin_invalidar and not self._invalidar_compartido(set()):
+            return None
+        try:
+            return self.compartido.version()
+        except sqlite3.Error:
+            logger.warning("Almacén compartido no disponible al leer", exc_info=True)
+            return None
+
+    def techs(self, db: Session, vt_id: int) -> int:
+        return self.obtener(db, vt_id, AGREGADO_TECHS)
+
+    def rfis_por_estado(self, db: Session, vt_id: int) -> Dict[str, int]:
+        return self.obtener(db, vt_id, AGREGADO_RFIS_POR_ESTADO)
+
+    def proveedores(self, db: Session, vt_id: int) -> int:
+        return self.obtener(db, vt_id, AGREGADO_PROVEEDORES)
+
+    def contactos(self, db: Session, vt_id: int) -> int:
+        return self.obtener(db, vt_id, AGREGADO_CONTACTOS)
+
+    def resumen(self, db: Session, vt_id: int) -> Dict[str, Any]:
+        """Todos los agregados de la VT en un diccionario"""
+        return {agregado: self.obtener(db, vt_id, agregado) for agregado in AGREGADOS}
+
+    def _guardar(
+        self, clave: Tuple[int, str], valor: Any, expira: float, version: Optional[int]
+    ) -> None:
+        # Se asume self._lock adquirido
+        self._entradas[clave] = (expira, valor, version)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.maxsize:
+            self._entradas.popitem(last=False)
+            self.evictions += 1
+
+    # --- invalidación ----------------------------------------------------- #
+    def invalidar(self, claves: Iterable[Clave]) -> None:
+        """Elimina las claves indicadas; ``vt_id=None`` afecta a todas las VT"""
+        claves = set(claves)
+        if not claves:
+            return
+        globales = {agregado for vt_id, agregado in claves if vt_id is None}
+        with self._lock:
+            self._generacion += 1
+            for clave in list(self._entradas):
+                if clave in claves or clave[1] in globales:
+                    del self._entradas[clave]
+        if self.compartido is not None:
+            self._invalidar_compartido(claves)
+
+    def _invalidar_compartido(self, claves: Set[Clave]) -> bool:
+        """Invalida en el almacén compartido sin propagar errores: el commit
+        en la BD ya ocurrió y no debe fallar por la caché"""
+        with self._lock:
+            self._sin_invalidar |= claves
+            lote = set(self._sin_invalidar)
+        try:
+            self.compartido.invalidar(lote)
+        except sqlite3.Error:
+            logger.warning(
+                "No se pudo invalidar el almacén compartido; se reintentará",
+                exc_info=True,
+            )
+            return False
+        with self._lock:
+            self._sin_invalidar -= lote
+        return True
+
+    def invalidar_vt(self, vt_id: int) -> None:
+        self.invalidar((vt_id, agregado) for agregado in AGREGADOS)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._generacion += 1
+            self._entradas.clear()
+        if self.compartido is not None:
+            self._invalidar_compartido({(None, agregado) for agregado in AGREGADOS})
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entradas": len(self._entradas),
+            }
+
+    # --- eventos de SQLAlchemy -------------------------------------------- #
+    def registrar(self, target: Any = Session) -> None:
+        """Engancha la invalidación a los eventos de sesión de ``target``
+        (una clase Session o un sessionmaker)"""
+        event.listen(target, "before_flush", _recolectar_previos)
+        event.listen(target, "after_flush", _recolectar_flush)
+        event.listen(target, "do_orm_execute", _recolectar_masivo)
+        event.listen(target, "after_transaction_end", _recolectar_bulk_save)
+        event.listen(target, "after_commit", self._al_commit)
+        event.listen(target, "after_transaction_end", self._al_terminar)
+
+    def _al_commit(self, session: Session) -> None:
+        self.invalidar(session.info.pop(_CLAVE_PENDIENTES, ()))
+
+    def _al_terminar(self, session: Session, transaction: Any) -> None:
+        # Sólo al cerrar la transacción raíz: un savepoint revertido no
+        # descarta lo que ya flusheó la transacción exterior. Tras un rollback
+        # se invalida igualmente, por si algo se leyó con datos sin confirmar.
+        if transaction.parent is None:
+            self.invalidar(session.info.pop(_CLAVE_PENDIENTES, ()))
+
+
+def _pendientes(session: Session) -> Set[Clave]:
+    return session.info.setdefault(_CLAVE_PENDIENTES, set())
+
+
+def _vt_ids(obj: Any, columna: str) -> Set[int]:
+    """vt_id actual y anterior (si cambió) de la columna indicada"""
+    historia = inspect(obj).attrs[columna].history
+    return {
+        valor
+        for valor in (*historia.added, *historia.unchanged, *historia.deleted)
+        if valor is not None
+    }
+
+
+def _recolectar_previos(session: Session, flush_context: Any, instances: Any) -> None:
+    session.info[_CLAVE_FLUSH] = flush_context
+    # Si el objeto estaba expirado (p. ej. tras un commit), la historia no
+    # conoce el vt_id anterior: leerlo de la BD antes de que el flush lo pise,
+    # con una consulta IN por modelo
+    ids_por_modelo: Dict[type, Set[int]] = {}
+    for obj in (*session.dirty, *session.deleted):
+        tabla = getattr(obj, "__tablename__", None)
+        if tabla not in DEPENDENCIAS or isinstance(obj, (VT, *PADRES)):
+            continue
+        columna = "rfi_id" if isinstance(obj, EstadoRFI) else "vt_id"
+        historia = inspect(obj).attrs[columna].history
+        if historia.unchanged or historia.deleted:
+            continue
+        ids_por_modelo.setdefault(type(obj), set()).add(inspect(obj).identity[0])
+
+    pendientes = _pendientes(session)
+    for modelo, ids in ids_por_modelo.items():
+        if modelo is EstadoRFI:
+            stmt = (
+                select(RFI.vt_id)
+                .join_from(EstadoRFI, RFI, RFI.id == EstadoRFI.rfi_id)
+                .where(EstadoRFI.id.in_(ids))
+            )
+        else:
+            stmt = select(modelo.vt_id).where(modelo.id.in_(ids))
+        agregados = DEPENDENCIAS[modelo.__tablename__]
+        for vt_id in session.connection().execute(stmt.distinct()).scalars():
+            pendientes.update((vt_id, agregado) for agregado in agregados)
+
+
+def _recolectar_flush(session: Session, flush_context: Any) -> None:
+    pendientes = _pendientes(session)
+    rfi_ids: Set[int] = set()
+    # Cambiar sólo colecciones (p. ej. vt.rfis) no altera ninguna fila leída
+    modificados = [
+        obj
+        for obj in session.dirty
+        if not isinstance(obj, VT) and session.is_modified(obj, include_collections=False)
+    ]
+    for obj in (*session.new, *modificados, *session.deleted):
+        tabla = getattr(obj, "__tablename__", None)
+        if tabla not in DEPENDENCIAS:
+            continue
+        if isinstance(obj, PADRES):
+            # Editar un padre no cambia ningún conteo; borrarlo sí, en cascada
+            vt_ids = {None} if obj in session.deleted else set()
+        elif isinstance(obj, VT):
+            vt_ids = {obj.id}
+        elif isinstance(obj, EstadoRFI):
+            rfi_ids |= _vt_ids(obj, "rfi_id")
+            continue
+        else:
+            vt_ids = _vt_ids(obj, "vt_id")
+        for vt_id in vt_ids:
+            pendientes.update((vt_id, agregado) for agregado in DEPENDENCIAS[tabla])
+
+    if rfi_ids:
+        # Si la RFI se borró en este mismo flush, su eliminación ya registró la VT
+        stmt = select(RFI.vt_id).where(RFI.id.in_(rfi_ids))
+        for vt_id in session.connection().execute(stmt).scalars():
+            pendientes.add((vt_id, AGREGADO_RFIS_POR_ESTADO))
+
+
+def _recolectar_masivo(orm_execute_state: Any) -> None:
+    # INSERT/UPDATE/DELETE masivos no pasan por el flush: invalidar todas las VT
+    if not (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if orm_execute_state.is_update and getattr(mapper, "class_", None) in PADRES:
+        return
+    tabla = getattr(mapper, "local_table", None)
+    agregados = DEPENDENCIAS.get(getattr(tabla, "name", None), ())
+    _pendientes(orm_execute_state.session).update((None, agregado) for agregado in agregados)
+
+
+def _recolectar_bulk_save(session: Session, transaction: Any) -> None:
+    # bulk_save_objects / bulk_*_mappings escriben en una subtransacción sin
+    # eventos de flush ni do_orm_execute. Es la única subtransacción no
+    # anidada que no pertenece a un flush; como no se sabe qué tabla tocó,
+    # se invalidan todos los agregados de todas las VT.
+    if transaction.parent is None or transaction.nested:
+        return
+    flush_context = session.info.pop(_CLAVE_FLUSH, None)
+    if getattr(flush_context, "transaction", None) is transaction:
+        return
+    _pendientes(session).update((None, agregado) for agregado in AGREGADOS)
+
+
+# Instancia por defecto, enganchada a las sesiones de la aplicación
+cache_agregados = CacheAgregadosVT(ruta_compartida=VT_CACHE_PATH or None)
+cache_agregados.registrar(SessionLocal)
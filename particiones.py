@@ -0,0 +1,383 @@
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from database import engine
+from cache_vt import AGREGADO_PROVEEDORES, AGREGADO_RFIS_POR_ESTADO, cache_agregados
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configuración del mantenimiento de particiones
+PARTICIONES_MESES_FUTUROS = int(os.getenv("PARTICIONES_MESES_FUTUROS", "3"))
+PARTICIONES_RETENCION_MESES = int(os.getenv("PARTICIONES_RETENCION_MESES", "0"))
+PARTICIONES_ELIMINAR = os.getenv("PARTICIONES_ELIMINAR", "false").lower() == "true"
+# Retirar historia de estados_rfi puede borrar el estado más reciente de RFIs
+# inactivas (pasarían a "sin_estado" en la caché): desactivado por defecto
+PARTICIONES_RETENCION_ESTADOS_RFI = (
+    os.getenv("PARTICIONES_RETENCION_ESTADOS_RFI", "false").lower() == "true"
+)
+
+MIGRACION_VERSION = "20261019_particiones_fecha"
+MIGRACION_NOMBRE = "Particionado mensual de resultados_busquedas y estados_rfi"
+
+# --- Tablas particionadas por RANGE (fecha) --------------------------------- #
+# La PK pasa a ser (id, fecha) porque PostgreSQL exige incluir la clave de
+# partición; el ORM sigue identificando las filas sólo por ``id``.
+TABLAS_PARTICIONADAS = {
+    "resultados_busquedas": {
+        "columnas": """
+            id BIGINT NOT NULL DEFAULT nextval('{secuencia}'),
+            proveedor_id BIGINT NOT NULL REFERENCES proveedores (id) ON DELETE CASCADE,
+            tech_id BIGINT NOT NULL REFERENCES tech_servicios (id) ON DELETE CASCADE,
+            vt_id BIGINT NOT NULL REFERENCES vt (id) ON DELETE CASCADE,
+            fecha TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, fecha)
+        """,
+        "copia": "id, proveedor_id, tech_id, vt_id, fecha",
+        "indices": (
+            "CREATE INDEX ix_resultados_busquedas_vt_fecha"
+            " ON resultados_busquedas (vt_id, fecha)",
+        ),
+        "agregados": (AGREGADO_PROVEEDORES,),
+        "retencion": True,
+    },
+    "estados_rfi": {
+        "columnas": """
+            id BIGINT NOT NULL DEFAULT nextval('{secuencia}'),
+            rfi_id BIGINT NOT NULL REFERENCES rfi (id) ON DELETE CASCADE,
+            estado TEXT NOT NULL,
+            fecha TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (id, fecha)
+        """,
+        "copia": "id, rfi_id, estado, fecha",
+        "indices": (
+            "CREATE INDEX ix_estados_rfi_rfi_fecha ON estados_rfi (rfi_id, fecha)",
+        ),
+        "agregados": (AGREGADO_RFIS_POR_ESTADO,),
+        "retencion": PARTICIONES_RETENCION_ESTADOS_RFI,
+    },
+}
+
+
+# =========================  UTILIDADES DE FECHAS  ========================== #
+def _inicio_mes(fecha: date) -> date:
+    return date(fecha.year, fecha.month, 1)
+
+
+def _sumar_meses(fecha: date, meses: int) -> date:
+    total = fecha.year * 12 + fecha.month - 1 + meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _limite(fecha: date) -> str:
+    """Literal de límite de partición (medianoche UTC)"""
+    return f"'{fecha.isoformat()} 00:00:00+00'"
+
+
+def _nombre_particion(tabla: str, inicio: date) -> str:
+    return f"{tabla}_p{inicio:%Y%m}"
+
+
+def _hoy() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def _corte_retencion(hoy: date, meses: int) -> date:
+    """Primer día que se conserva: inicio del mes actual menos ``meses``"""
+    return _sumar_meses(_inicio_mes(hoy), -meses)
+
+
+def particiones_expiradas(mensuales: Dict[str, date], hoy: date, meses: int) -> List[str]:
+    """Particiones (nombre -> inicio de mes) cuyo rango termina antes del corte"""
+    if meses <= 0:
+        return []
+    corte = _corte_retencion(hoy, meses)
+    return [
+        nombre
+        for nombre, inicio in sorted(mensuales.items(), key=lambda item: item[1])
+        if _sumar_meses(inicio, 1) <= corte
+    ]
+
+
+# =========================  CONSULTAS AL CATÁLOGO  ========================= #
+def esta_particionada(conn: Connection, tabla: str) -> bool:
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:tabla)"),
+        {"tabla": tabla},
+    ).scalar()
+    return relkind == "p"
+
+
+def listar_particiones(conn: Connection, tabla: str) -> List[str]:
+    """Nombres de las particiones adjuntas a la tabla"""
+    filas = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i"
+            " JOIN pg_class c ON c.oid = i.inhrelid"
+            " WHERE i.inhparent = to_regclass(:tabla)"
+            " ORDER BY c.relname"
+        ),
+        {"tabla": tabla},
+    )
+    return list(filas.scalars())
+
+
+def _particiones_mensuales(conn: Connection, tabla: str) -> Dict[str, date]:
+    patron = re.compile(rf"{re.escape(tabla)}_p(\d{{4}})(\d{{2}})")
+    mensuales = {}
+    for nombre in listar_particiones(conn, tabla):
+        coincidencia = patron.fullmatch(nombre)
+        if coincidencia:
+            anio, mes = coincidencia.groups()
+            mensuales[nombre] = date(int(anio), int(mes), 1)
+    return mensuales
+
+
+# =========================  CREACIÓN DE PARTICIONES  ======================= #
+def crear_particion(conn: Connection, tabla: str, inicio: date) -> bool:
+    """Crea la partición mensual que empieza en ``inicio`` si no existe.
+
+    Las filas de ese rango que hubieran caído en la partición por defecto se
+    trasladan antes de adjuntarla.
+    """
+    inicio = _inicio_mes(inicio)
+    nombre = _nombre_particion(tabla, inicio)
+    if nombre in listar_particiones(conn, tabla):
+        return False
+    desde, hasta = _limite(inicio), _limite(_sumar_meses(inicio, 1))
+
+    # exec_driver_sql: los literales de fecha llevan ":" que text() tomaría por parámetros
+    conn.exec_driver_sql(
+        f"CREATE TABLE {nombre} (LIKE {tabla} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    )
+    conn.exec_driver_sql(
+        f"WITH movidas AS ("
+        f" DELETE FROM {tabla}_default WHERE fecha >= {desde} AND fecha < {hasta}"
+        f" RETURNING *)"
+        f" INSERT INTO {nombre} SELECT * FROM movidas"
+    )
+    conn.exec_driver_sql(
+        f"ALTER TABLE {tabla} ATTACH PARTITION {nombre} FOR VALUES FROM ({desde}) TO ({hasta})"
+    )
+    return True
+
+
+def crear_particiones_futuras(
+    conn: Connection, tabla: str, meses: int = PARTICIONES_MESES_FUTUROS
+) -> List[str]:
+    """Asegura particiones desde el mes actual hasta ``meses`` meses adelante"""
+    actual = _inicio_mes(_hoy())
+    creadas = []
+    for desplazamiento in range(meses + 1):
+        inicio = _sumar_meses(actual, desplazamiento)
+        if crear_particion(conn, tabla, inicio):
+            creadas.append(_nombre_particion(tabla, inicio))
+    return creadas
+
+
+# =========================  RETENCIÓN  ===================================== #
+def aplicar_retencion(
+    conn: Connection,
+    tabla: str,
+    meses: int = PARTICIONES_RETENCION_MESES,
+    eliminar: bool = PARTICIONES_ELIMINAR,
+) -> Tuple[List[str], int]:
+    """Desadjunta (o elimina, si ``eliminar``) las particiones cuyo rango
+    termina antes de los últimos ``meses`` meses completos. ``meses <= 0``
+    desactiva la retención.
+
+    Las filas expiradas que cayeron en la partición por defecto (inserciones
+    tardías de un mes ya retirado) se trasladan a la tabla archivada de su mes
+    o, si ``eliminar``, se borran.
+
+    Devuelve las particiones/tablas archivadas retiradas y el número de filas
+    borradas de la partición por defecto.
+    """
+    if meses <= 0:
+        return [], 0
+    retiradas = particiones_expiradas(_particiones_mensuales(conn, tabla), _hoy(), meses)
+    for nombre in retiradas:
+        conn.execute(text(f"ALTER TABLE {tabla} DETACH PARTITION {nombre}"))
+        if eliminar:
+            conn.execute(text(f"DROP TABLE {nombre}"))
+
+    # exec_driver_sql: los literales de fecha llevan ":" que text() tomaría por parámetros
+    corte = _limite(_corte_retencion(_hoy(), meses))
+    if eliminar:
+        borradas = conn.exec_driver_sql(f"DELETE FROM {tabla}_default WHERE fecha < {corte}")
+        return retiradas, borradas.rowcount
+
+    meses_tardios = conn.exec_driver_sql(
+        f"SELECT DISTINCT date_trunc('month', fecha AT TIME ZONE 'UTC')::date"
+        f" FROM {tabla}_default WHERE fecha < {corte}"
+    ).scalars()
+    for inicio in sorted(meses_tardios):
+        nombre = _nombre_particion(tabla, inicio)
+        desde, hasta = _limite(inicio), _limite(_sumar_meses(inicio, 1))
+        conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {nombre}"
+            f" (LIKE {tabla} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        conn.exec_driver_sql(
+            f"WITH movidas AS ("
+            f" DELETE FROM {tabla}_default WHERE fecha >= {desde} AND fecha < {hasta}"
+            f" RETURNING *)"
+            f" INSERT INTO {nombre} SELECT * FROM movidas"
+        )
+        if nombre not in retiradas:
+            retiradas.append(nombre)
+    return retiradas, 0
+
+
+# =========================  MIGRACIÓN  ===================================== #
+def migrar_tabla(
+    conn: Connection, tabla: str, meses_futuros: int = PARTICIONES_MESES_FUTUROS
+) -> bool:
+    """Convierte ``tabla`` en una tabla particionada por mes conservando
+    datos, secuencia de ids y claves foráneas. No hace nada si ya lo está.
+
+    ``id`` puede ser SERIAL/BIGSERIAL o IDENTITY; en el segundo caso pasa a
+    tomar su valor por defecto de una secuencia normal.
+    """
+    if esta_particionada(conn, tabla):
+        return False
+    definicion = TABLAS_PARTICIONADAS[tabla]
+    antigua = f"{tabla}_sin_particionar"
+    identidad = conn.execute(
+        text(
+            "SELECT attidentity FROM pg_attribute"
+            " WHERE attrelid = to_regclass(:tabla) AND attname = 'id'"
+        ),
+        {"tabla": tabla},
+    ).scalar()
+    # pg_get_serial_sequence también devuelve la secuencia de una columna identity
+    secuencia = conn.execute(
+        text("SELECT pg_get_serial_sequence(:tabla, 'id')"), {"tabla": tabla}
+    ).scalar()
+    if secuencia is None:
+        raise RuntimeError(
+            f"{tabla}.id no es SERIAL/BIGSERIAL ni IDENTITY: no hay secuencia que conservar"
+        )
+
+    # Liberar los nombres de tabla y PK para la nueva tabla particionada
+    conn.execute(text(f"ALTER TABLE {tabla} RENAME TO {antigua}"))
+    conn.execute(text(f"ALTER TABLE {antigua} DROP CONSTRAINT IF EXISTS {tabla}_pkey"))
+    if identidad in ("a", "d"):
+        # Las tablas particionadas no admiten IDENTITY antes de PostgreSQL 17:
+        # se sustituye por una secuencia propia que continúa la numeración
+        siguiente = conn.execute(
+            text(
+                "SELECT CASE WHEN is_called THEN last_value + 1 ELSE last_value END"
+                f" FROM {secuencia}"
+            )
+        ).scalar_one()
+        conn.execute(text(f"ALTER TABLE {antigua} ALTER COLUMN id DROP IDENTITY"))
+        secuencia = f"{tabla}_id_seq"
+        conn.execute(text(f"CREATE SEQUENCE {secuencia} AS BIGINT"))
+        conn.execute(
+            text(
+                f"SELECT setval('{secuencia}',"
+                f" GREATEST(:siguiente, (SELECT COALESCE(max(id), 0) + 1 FROM {antigua})),"
+                f" false)"
+            ),
+            {"siguiente": siguiente},
+        )
+    else:
+        conn.execute(text(f"ALTER SEQUENCE {secuencia} OWNED BY NONE"))
+
+    columnas = definicion["columnas"].format(secuencia=secuencia)
+    conn.execute(text(f"CREATE TABLE {tabla} ({columnas}) PARTITION BY RANGE (fecha)"))
+    conn.execute(text(f"ALTER SEQUENCE {secuencia} OWNED BY {tabla}.id"))
+    for indice in definicion["indices"]:
+        conn.execute(text(indice))
+    conn.execute(text(f"CREATE TABLE {tabla}_default PARTITION OF {tabla} DEFAULT"))
+
+    primera = conn.execute(text(f"SELECT min(fecha) FROM {antigua}")).scalar()
+    inicio = _inicio_mes(primera.astimezone(timezone.utc).date() if primera else _hoy())
+    fin = _sumar_meses(_inicio_mes(_hoy()), meses_futuros)
+    while inicio <= fin:
+        crear_particion(conn, tabla, inicio)
+        inicio = _sumar_meses(inicio, 1)
+
+    copia = definicion["copia"]
+    conn.execute(text(f"INSERT INTO {tabla} ({copia}) SELECT {copia} FROM {antigua}"))
+    conn.execute(text(f"DROP TABLE {antigua}"))
+    conn.execute(text(f"ANALYZE {tabla}"))
+    return True
+
+
+def migrar(bind: Engine = engine) -> List[str]:
+    """Particiona todas las tablas de TABLAS_PARTICIONADAS y registra la
+    migración. Cada tabla se migra en su propia transacción."""
+    migradas = []
+    for tabla in TABLAS_PARTICIONADAS:
+        with bind.begin() as conn:
+            if migrar_tabla(conn, tabla):
+                migradas.append(tabla)
+    with bind.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO migrations (version, name) VALUES (:version, :nombre)"
+                " ON CONFLICT (version) DO NOTHING"
+            ),
+            {"version": MIGRACION_VERSION, "nombre": MIGRACION_NOMBRE},
+        )
+    return migradas
+
+
+# =========================  MANTENIMIENTO PERIÓDICO  ======================= #
+def mantener(
+    bind: Engine = engine,
+    meses_futuros: int = PARTICIONES_MESES_FUTUROS,
+    meses_retencion: int = PARTICIONES_RETENCION_MESES,
+    eliminar: bool = PARTICIONES_ELIMINAR,
+) -> Dict[str, Dict[str, Any]]:
+    """Crea las particiones futuras y aplica la retención a las tablas que la
+    tienen activada (pensado para cron).
+
+    La retención sólo llega a la caché de los procesos de la aplicación a
+    través del almacén compartido (``VT_CACHE_PATH``): sin él, los agregados
+    en memoria reflejan la historia retirada al cabo de ``VT_CACHE_TTL``.
+    """
+    resumen = {}
+    for tabla, definicion in TABLAS_PARTICIONADAS.items():
+        with bind.begin() as conn:
+            if not esta_particionada(conn, tabla):
+                continue
+            creadas = crear_particiones_futuras(conn, tabla, meses_futuros)
+            retiradas, filas_borradas = (
+                aplicar_retencion(conn, tabla, meses_retencion, eliminar)
+                if definicion["retencion"]
+                else ([], 0)
+            )
+        if (retiradas or filas_borradas) and cache_agregados.compartido is not None:
+            # Quitar historia cambia los agregados de todas las VT; la versión
+            # del almacén compartido avisa a los procesos de la aplicación
+            cache_agregados.invalidar((None, agregado) for agregado in definicion["agregados"])
+        resumen[tabla] = {
+            "creadas": creadas,
+            "retiradas": retiradas,
+            "filas_borradas": filas_borradas,
+        }
+    return resumen
+
+
+if __name__ == "__main__":
+    import sys
+
+    argumentos = sys.argv[1:]
+    if argumentos not in ([], ["migrar"]):
+        sys.exit(f"Uso: python {sys.argv[0]} [migrar]")
+    if argumentos == ["migrar"]:
+        print("Tablas migradas:", migrar() or "ninguna")
+    for tabla, cambios in mantener().items():
+        print(
+            f"{tabla}: creadas={cambios['creadas']} retiradas={cambios['retiradas']}"
+            f" filas_borradas={cambios['filas_borradas']}"
+        )
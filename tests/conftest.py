@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+from sqlalchemy import BigInteger, create_engine, event, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+
+# Los tests de particiones sólo corren si DATABASE_URL apunta a PostgreSQL
+# (cada uno en un esquema propio que se borra al terminar)
+_URL = os.environ.get("DATABASE_URL", "")
+URL_POSTGRES = _URL if _URL.startswith("postgresql") else None
+
+# El resto usa SQLite; en fichero para que cada sesión tenga su propia
+# conexión y no vea lo que otra no ha confirmado
+_BD_TESTS = os.path.join(tempfile.mkdtemp(), "tests.sqlite")
+os.environ["DATABASE_URL"] = f"sqlite:///{_BD_TESTS}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@compiles(BigInteger, "sqlite")
+def _bigint_sqlite(type_, compiler, **kw):
+    # SQLite sólo autoincrementa columnas INTEGER PRIMARY KEY
+    return "INTEGER"
+
+
+from database import Base, engine  # noqa: E402
+import all_models  # noqa: E402,F401
+
+
+@event.listens_for(engine, "connect")
+def _activar_claves_foraneas(dbapi_connection, connection_record):
+    # Necesario para que ON DELETE CASCADE actúe como en PostgreSQL
+    dbapi_connection.execute("PRAGMA foreign_keys = ON")
+
+
+@pytest.fixture
+def Sesion():
+    Base.metadata.create_all(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def engine_pg():
+    if URL_POSTGRES is None:
+        pytest.skip("DATABASE_URL no apunta a PostgreSQL")
+    esquema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = create_engine(URL_POSTGRES)
+    with admin.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {esquema}"))
+    en_esquema = create_engine(
+        URL_POSTGRES, connect_args={"options": f"-csearch_path={esquema}"}
+    )
+    Base.metadata.create_all(en_esquema)
+    yield en_esquema
+    en_esquema.dispose()
+    with admin.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA {esquema} CASCADE"))
+    admin.dispose()
@@ -0,0 +1,370 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete, event, insert, update
+
+import cache_vt
+from all_models import (
+    VT,
+    RFI,
+    Contacto,
+    ContactoVT,
+    EstadoRFI,
+    Proveedor,
+    ResultadoBusqueda,
+    TechServicio,
+    TechVT,
+)
+from cache_vt import CacheAgregadosVT
+from database import engine
+
+
+@pytest.fixture
+def cache(Sesion):
+    cache = CacheAgregadosVT(maxsize=100, ttl=60)
+    cache.registrar(Sesion)
+    return cache
+
+
+@pytest.fixture
+def datos(Sesion):
+    """Dos VT, un proveedor con contacto y una tecnología"""
+    with Sesion() as db:
+        ahora = datetime(2026, 1, 1)
+        vts = [
+            VT(nombre=f"vt{i}", tecnologia="t", cliente="c", fecha_entrada=ahora)
+            for i in range(2)
+        ]
+        proveedor = Proveedor(nombre="p")
+        tech = TechServicio(nombre="x", caracteristicas="y")
+        contacto = Contacto(nombre="c", proveedor=proveedor)
+        db.add_all([*vts, proveedor, tech, contacto])
+        db.commit()
+        return {
+            "vt": vts[0].id,
+            "otra_vt": vts[1].id,
+            "proveedor": proveedor.id,
+            "tech": tech.id,
+            "contacto": contacto.id,
+        }
+
+
+def test_insercion_invalida_solo_el_agregado_y_la_vt_tocados(Sesion, cache, datos):
+    with Sesion() as db:
+        cache.resumen(db, datos["vt"])
+        cache.resumen(db, datos["otra_vt"])
+        db.add(TechVT(tech_id=datos["tech"], vt_id=datos["vt"]))
+        db.commit()
+
+        assert cache.estadisticas()["entradas"] == 7
+        assert cache.techs(db, datos["vt"]) == 1
+        assert cache.contactos(db, datos["vt"]) == 0
+        assert cache.techs(db, datos["otra_vt"]) == 0
+        assert cache.estadisticas()["hits"] == 2
+
+
+def test_actualizacion_invalida_vt_anterior_y_nueva(Sesion, cache, datos):
+    with Sesion() as db:
+        enlace = TechVT(tech_id=datos["tech"], vt_id=datos["vt"])
+        db.add(enlace)
+        db.commit()
+        assert cache.techs(db, datos["vt"]) == 1
+        assert cache.techs(db, datos["otra_vt"]) == 0
+
+        enlace.vt_id = datos["otra_vt"]
+        db.commit()
+        assert cache.techs(db, datos["vt"]) == 0
+        assert cache.techs(db, datos["otra_vt"]) == 1
+
+
+def test_borrado_y_estado_mas_reciente_de_rfi(Sesion, cache, datos):
+    with Sesion() as db:
+        rfi = RFI(nombre="r", proveedor_id=datos["proveedor"], vt_id=datos["vt"])
+        db.add(rfi)
+        db.commit()
+        assert cache.rfis_por_estado(db, datos["vt"]) == {cache_vt.SIN_ESTADO: 1}
+
+        db.add_all([
+            EstadoRFI(rfi_id=rfi.id, estado="enviada", fecha=datetime(2026, 1, 1)),
+            EstadoRFI(rfi_id=rfi.id, estado="respondida", fecha=datetime(2026, 2, 1)),
+        ])
+        db.commit()
+        assert cache.rfis_por_estado(db, datos["vt"]) == {"respondida": 1}
+
+        db.delete(db.query(EstadoRFI).filter_by(estado="respondida").one())
+        db.commit()
+        assert cache.rfis_por_estado(db, datos["vt"]) == {"enviada": 1}
+
+        db.delete(rfi)
+        db.commit()
+        assert cache.rfis_por_estado(db, datos["vt"]) == {}
+
+
+def test_sentencias_masivas_invalidan_todas_las_vt(Sesion, cache, datos):
+    with Sesion() as db:
+        db.add_all([
+            ContactoVT(contacto_id=datos["contacto"], vt_id=datos["vt"]),
+            ContactoVT(contacto_id=datos["contacto"], vt_id=datos["otra_vt"]),
+        ])
+        db.commit()
+        assert cache.contactos(db, datos["vt"]) == 1
+        assert cache.contactos(db, datos["otra_vt"]) == 1
+
+        db.execute(update(ContactoVT).values(vt_id=datos["vt"]))
+        db.commit()
+        assert cache.contactos(db, datos["vt"]) == 2
+        assert cache.contactos(db, datos["otra_vt"]) == 0
+
+        db.execute(delete(ContactoVT))
+        db.commit()
+        assert cache.contactos(db, datos["vt"]) == 0
+
+
+def test_insercion_masiva_invalida_todas_las_vt(Sesion, cache, datos):
+    with Sesion() as db:
+        assert cache.techs(db, datos["vt"]) == 0
+        db.execute(insert(TechVT), [{"tech_id": datos["tech"], "vt_id": datos["vt"]}])
+        db.commit()
+        assert cache.techs(db, datos["vt"]) == 1
+
+
+def test_bulk_save_objects_invalida_todas_las_vt(Sesion, cache, datos):
+    with Sesion() as db:
+        assert cache.contactos(db, datos["vt"]) == 0
+        db.bulk_save_objects([ContactoVT(contacto_id=datos["contacto"], vt_id=datos["vt"])])
+        db.commit()
+        assert cache.contactos(db, datos["vt"]) == 1
+
+
+def test_borrar_proveedor_invalida_hijos_en_cascada(Sesion, cache, datos):
+    with Sesion() as db:
+        db.add_all([
+            ContactoVT(contacto_id=datos["contacto"], vt_id=datos["vt"]),
+            RFI(nombre="r", proveedor_id=datos["proveedor"], vt_id=datos["vt"]),
+            ResultadoBusqueda(
+                proveedor_id=datos["proveedor"], tech_id=datos["tech"], vt_id=datos["vt"]
+            ),
+        ])
+        db.commit()
+        assert cache.resumen(db, datos["vt"])["contactos"] == 1
+
+    with Sesion() as db:
+        db.delete(db.get(Proveedor, datos["proveedor"]))
+        db.commit()
+        assert cache.resumen(db, datos["vt"]) == {
+            "techs": 0,
+            "rfis_por_estado": {},
+            "proveedores": 0,
+            "contactos": 0,
+        }
+
+
+def test_borrado_masivo_de_tecnologias_invalida_en_cascada(Sesion, cache, datos):
+    with Sesion() as db:
+        db.add_all([
+            TechVT(tech_id=datos["tech"], vt_id=datos["vt"]),
+            ResultadoBusqueda(
+                proveedor_id=datos["proveedor"], tech_id=datos["tech"], vt_id=datos["vt"]
+            ),
+        ])
+        db.commit()
+        assert cache.techs(db, datos["vt"]) == 1
+        assert cache.proveedores(db, datos["vt"]) == 1
+
+        db.execute(delete(TechServicio))
+        db.commit()
+        assert cache.techs(db, datos["vt"]) == 0
+        assert cache.proveedores(db, datos["vt"]) == 0
+
+
+def test_borrar_contacto_invalida_contactos_vt(Sesion, cache, datos):
+    with Sesion() as db:
+        db.add(ContactoVT(contacto_id=datos["contacto"], vt_id=datos["vt"]))
+        db.commit()
+        assert cache.contactos(db, datos["vt"]) == 1
+
+    with Sesion() as db:
+        db.delete(db.get(Contacto, datos["contacto"]))
+        db.commit()
+        assert cache.contactos(db, datos["vt"]) == 0
+
+
+def test_editar_padre_no_invalida(Sesion, cache, datos):
+    with Sesion() as db:
+        cache.resumen(db, datos["vt"])
+        db.get(Proveedor, datos["proveedor"]).web = "https://p.example"
+        db.commit()
+        assert cache.estadisticas()["entradas"] == 4
+
+
+def test_savepoint_revertido_conserva_invalidaciones_exteriores(Sesion, cache, datos):
+    with Sesion() as db:
+        assert cache.techs(db, datos["vt"]) == 0
+        db.add(TechVT(tech_id=datos["tech"], vt_id=datos["vt"]))
+        db.flush()
+        db.begin_nested().rollback()
+        db.commit()
+        assert cache.techs(db, datos["vt"]) == 1
+
+
+def test_lectura_con_escrituras_sin_confirmar_no_se_cachea(Sesion, cache, datos):
+    with Sesion() as db:
+        db.add(TechVT(tech_id=datos["tech"], vt_id=datos["vt"]))
+        db.commit()
+
+    with Sesion() as db:
+        db.add(TechVT(tech_id=datos["tech"], vt_id=datos["vt"]))
+        db.flush()
+        assert cache.techs(db, datos["vt"]) == 2
+        assert cache.estadisticas()["entradas"] == 0
+        db.rollback()
+        assert cache.techs(db, datos["vt"]) == 1
+
+
+def test_rollback_invalida_lo_recolectado(Sesion, cache, datos):
+    with Sesion() as db:
+        db.add(TechVT(tech_id=datos["tech"], vt_id=datos["vt"]))
+        db.flush()
+        # Otra sesión cachea mientras la primera tiene escrituras pendientes
+        with Sesion() as otra:
+            assert cache.techs(otra, datos["vt"]) == 0
+        db.rollback()
+        assert cache.estadisticas()["entradas"] == 0
+
+
+def test_lru_desaloja_la_entrada_menos_usada(Sesion, datos):
+    cache = CacheAgregadosVT(maxsize=2, ttl=60)
+    with Sesion() as db:
+        cache.techs(db, datos["vt"])
+        cache.contactos(db, datos["vt"])
+        cache.techs(db, datos["vt"])
+        cache.proveedores(db, datos["vt"])
+        assert cache.estadisticas() == {
+            "hits": 1,
+            "misses": 3,
+            "evictions": 1,
+            "entradas": 2,
+        }
+        cache.techs(db, datos["vt"])
+        assert cache.estadisticas()["hits"] == 2
+
+
+def test_ttl_expira_entradas(Sesion, datos, monkeypatch):
+    reloj = [1000.0]
+    monkeypatch.setattr(cache_vt.time, "time", lambda: reloj[0])
+    cache = CacheAgregadosVT(maxsize=10, ttl=60)
+    with Sesion() as db:
+        cache.techs(db, datos["vt"])
+        reloj[0] += 59
+        cache.techs(db, datos["vt"])
+        reloj[0] += 2
+        cache.techs(db, datos["vt"])
+    estadisticas = cache.estadisticas()
+    assert (estadisticas["hits"], estadisticas["misses"]) == (1, 2)
+
+
+def test_almacen_compartido_conserva_caducidad(Sesion, datos, tmp_path, monkeypatch):
+    reloj = [1000.0]
+    monkeypatch.setattr(cache_vt.time, "time", lambda: reloj[0])
+    ruta = str(tmp_path / "cache.sqlite")
+    escritor = CacheAgregadosVT(ttl=60, ruta_compartida=ruta)
+    lector = CacheAgregadosVT(ttl=60, ruta_compartida=ruta)
+    with Sesion() as db:
+        escritor.techs(db, datos["vt"])
+        reloj[0] += 50
+        lector.techs(db, datos["vt"])
+        assert lector.estadisticas()["hits"] == 1
+        reloj[0] += 15
+        lector.techs(db, datos["vt"])
+        assert lector.estadisticas()["misses"] == 1
+
+
+def test_almacen_compartido_rechaza_valor_anterior_a_invalidacion(tmp_path):
+    almacen = cache_vt.AlmacenCompartido(str(tmp_path / "cache.sqlite"))
+    version = almacen.version()
+    almacen.invalidar([(1, cache_vt.AGREGADO_TECHS)])
+    assert not almacen.guardar(1, cache_vt.AGREGADO_TECHS, 5, 1e12, version)
+    assert almacen.obtener(1, cache_vt.AGREGADO_TECHS)[0] is False
+    assert almacen.guardar(1, cache_vt.AGREGADO_TECHS, 5, 1e12, almacen.version())
+
+
+def test_valores_previos_se_leen_con_una_consulta_por_modelo(Sesion, cache, datos):
+    with Sesion() as db:
+        db.add_all(
+            ResultadoBusqueda(
+                proveedor_id=datos["proveedor"], tech_id=datos["tech"], vt_id=datos["vt"]
+            )
+            for _ in range(20)
+        )
+        db.commit()
+        assert cache.proveedores(db, datos["otra_vt"]) == 0
+        resultados = db.query(ResultadoBusqueda).all()
+        db.commit()
+
+        consultas = []
+        escuchar = lambda *args: consultas.append(args[2])  # noqa: E731
+        event.listen(engine, "before_cursor_execute", escuchar)
+        try:
+            for resultado in resultados:
+                resultado.vt_id = datos["otra_vt"]
+            db.commit()
+        finally:
+            event.remove(engine, "before_cursor_execute", escuchar)
+
+        # Las recargas de objetos expirados son del ORM; la caché añade una sola
+        previos = [sql for sql in consultas if sql.startswith("SELECT DISTINCT")]
+        selects = [sql for sql in consultas if sql.startswith("SELECT")]
+        assert len(previos) == 1
+        assert len(selects) <= len(resultados) + 1
+        assert cache.proveedores(db, datos["otra_vt"]) == 1
+
+
+def test_commit_de_otro_proceso_invalida_la_memoria(Sesion, datos, tmp_path):
+    ruta = str(tmp_path / "cache.sqlite")
+    escritor = CacheAgregadosVT(ttl=60, ruta_compartida=ruta)
+    escritor.registrar(Sesion)
+    lector = CacheAgregadosVT(ttl=60, ruta_compartida=ruta)
+    with Sesion() as db:
+        assert lector.techs(db, datos["vt"]) == 0
+        assert lector.techs(db, datos["vt"]) == 0
+        db.add(TechVT(tech_id=datos["tech"], vt_id=datos["vt"]))
+        db.commit()
+        assert lector.techs(db, datos["vt"]) == 1
+
+
+def test_almacen_bloqueado_no_rompe_el_commit(Sesion, datos, tmp_path):
+    ruta = str(tmp_path / "cache.sqlite")
+    escritor = CacheAgregadosVT(ttl=60, ruta_compartida=ruta)
+    escritor.compartido.timeout = 0.05
+    escritor.registrar(Sesion)
+    lector = CacheAgregadosVT(ttl=60, ruta_compartida=ruta)
+    with Sesion() as db:
+        assert lector.techs(db, datos["vt"]) == 0
+
+        bloqueo = sqlite3.connect(ruta, isolation_level=None)
+        bloqueo.execute("BEGIN EXCLUSIVE")
+        try:
+            db.add(TechVT(tech_id=datos["tech"], vt_id=datos["vt"]))
+            db.commit()
+            # Con la invalidación pendiente el escritor no confía en el almacén
+            assert escritor.techs(db, datos["vt"]) == 1
+        finally:
+            bloqueo.rollback()
+            bloqueo.close()
+
+        # La siguiente operación reintenta la invalidación
+        assert escritor.techs(db, datos["vt"]) == 1
+        assert lector.techs(db, datos["vt"]) == 1
+
+
+def test_almacen_ilegible_cae_a_la_bd(Sesion, datos, tmp_path, monkeypatch):
+    cache = CacheAgregadosVT(ttl=60, ruta_compartida=str(tmp_path / "cache.sqlite"))
+
+    def fallar(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(cache.compartido, "version", fallar)
+    with Sesion() as db:
+        assert cache.techs(db, datos["vt"]) == 0
+        assert cache.estadisticas()["misses"] == 1
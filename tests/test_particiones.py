@@ -0,0 +1,315 @@
+import subprocess
+import sys
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from all_models import RFI, VT, EstadoRFI, Proveedor, ResultadoBusqueda, TechServicio
+from benchmark_particiones import _consultas, explicar
+from particiones import (
+    PARTICIONES_MESES_FUTUROS,
+    _corte_retencion,
+    _hoy,
+    _inicio_mes,
+    _limite,
+    _nombre_particion,
+    _sumar_meses,
+    aplicar_retencion,
+    crear_particion,
+    esta_particionada,
+    listar_particiones,
+    migrar,
+    migrar_tabla,
+    particiones_expiradas,
+)
+
+
+@pytest.mark.parametrize(
+    "fecha, meses, esperado",
+    [
+        (date(2024, 11, 1), 1, date(2024, 12, 1)),
+        (date(2024, 12, 1), 1, date(2025, 1, 1)),
+        (date(2024, 11, 1), 14, date(2026, 1, 1)),
+        (date(2024, 1, 1), -1, date(2023, 12, 1)),
+        (date(2024, 3, 1), -15, date(2022, 12, 1)),
+        (date(2024, 5, 1), 0, date(2024, 5, 1)),
+    ],
+)
+def test_sumar_meses_cruza_anios(fecha, meses, esperado):
+    assert _sumar_meses(fecha, meses) == esperado
+
+
+def test_limite_y_nombre_de_particion():
+    assert _limite(date(2025, 1, 1)) == "'2025-01-01 00:00:00+00'"
+    assert _nombre_particion("estados_rfi", date(2025, 1, 1)) == "estados_rfi_p202501"
+
+
+def test_corte_retencion():
+    assert _corte_retencion(date(2025, 1, 15), 1) == date(2024, 12, 1)
+    assert _corte_retencion(date(2025, 3, 31), 3) == date(2024, 12, 1)
+
+
+def _mensuales(*meses):
+    return {_nombre_particion("t", inicio): inicio for inicio in meses}
+
+
+def test_retencion_de_un_mes_conserva_el_mes_anterior_y_el_actual():
+    mensuales = _mensuales(date(2024, 11, 1), date(2024, 12, 1), date(2025, 1, 1))
+    assert particiones_expiradas(mensuales, date(2025, 1, 15), 1) == ["t_p202411"]
+
+
+def test_retencion_en_el_primer_dia_del_mes():
+    mensuales = _mensuales(date(2024, 11, 1), date(2024, 12, 1), date(2025, 1, 1))
+    assert particiones_expiradas(mensuales, date(2025, 1, 1), 1) == ["t_p202411"]
+    assert particiones_expiradas(mensuales, date(2025, 2, 1), 1) == [
+        "t_p202411",
+        "t_p202412",
+    ]
+
+
+def test_retencion_desactivada_y_particiones_futuras():
+    mensuales = _mensuales(date(2020, 1, 1), date(2025, 3, 1))
+    assert particiones_expiradas(mensuales, date(2025, 1, 15), 0) == []
+    assert particiones_expiradas(mensuales, date(2025, 1, 15), 12) == ["t_p202001"]
+
+
+def test_argumento_desconocido_se_rechaza():
+    raiz = Path(__file__).resolve().parent.parent
+    resultado = subprocess.run(
+        [sys.executable, str(raiz / "particiones.py"), "migrate"],
+        capture_output=True,
+        text=True,
+        cwd=raiz,
+        env={"DATABASE_URL": "sqlite://", "PATH": ""},
+    )
+    assert resultado.returncode != 0
+    assert "Uso:" in resultado.stderr
+
+
+# =========================  POSTGRESQL (opcional)  ========================= #
+# Sólo corren con DATABASE_URL apuntando a PostgreSQL (fixture engine_postgres)
+MESES_SEMBRADOS = (-3, -2, -1, 0)
+FILAS_POR_MES = 3
+
+
+def _mes(desplazamiento):
+    return _sumar_meses(_inicio_mes(_hoy()), desplazamiento)
+
+
+def _fecha(desplazamiento):
+    inicio = _mes(desplazamiento)
+    return datetime(inicio.year, inicio.month, 15, 12, tzinfo=timezone.utc)
+
+
+def _sembrar(engine_pg):
+    with Session(engine_pg) as db:
+        vt = VT(nombre="vt", tecnologia="t", cliente="c", fecha_entrada=_fecha(0))
+        proveedor = Proveedor(nombre="p")
+        tech = TechServicio(nombre="x", caracteristicas="y")
+        db.add_all([vt, proveedor, tech])
+        db.flush()
+        rfi = RFI(nombre="r", proveedor_id=proveedor.id, vt_id=vt.id)
+        db.add(rfi)
+        db.flush()
+        for desplazamiento in MESES_SEMBRADOS:
+            for _ in range(FILAS_POR_MES):
+                db.add_all(
+                    [
+                        ResultadoBusqueda(
+                            proveedor_id=proveedor.id,
+                            tech_id=tech.id,
+                            vt_id=vt.id,
+                            fecha=_fecha(desplazamiento),
+                        ),
+                        EstadoRFI(rfi_id=rfi.id, estado="enviada", fecha=_fecha(desplazamiento)),
+                    ]
+                )
+        db.commit()
+        return {"vt": vt.id, "proveedor": proveedor.id, "tech": tech.id, "rfi": rfi.id}
+
+
+def _contar(conn, tabla):
+    return conn.execute(text(f"SELECT count(*) FROM {tabla}")).scalar_one()
+
+
+def _max_id(conn, tabla):
+    return conn.execute(text(f"SELECT max(id) FROM {tabla}")).scalar_one()
+
+
+def _nuevo_resultado(db, datos, desplazamiento):
+    resultado = ResultadoBusqueda(
+        proveedor_id=datos["proveedor"],
+        tech_id=datos["tech"],
+        vt_id=datos["vt"],
+        fecha=_fecha(desplazamiento),
+    )
+    db.add(resultado)
+    db.commit()
+    return resultado
+
+
+def _migrado(engine_pg):
+    datos = _sembrar(engine_pg)
+    migrar(engine_pg)
+    return datos
+
+
+def test_migrar_conserva_filas_secuencia_y_claves(engine_pg):
+    datos = _sembrar(engine_pg)
+    with engine_pg.connect() as conn:
+        maximos = {tabla: _max_id(conn, tabla) for tabla in ("resultados_busquedas", "estados_rfi")}
+
+    assert migrar(engine_pg) == ["resultados_busquedas", "estados_rfi"]
+
+    esperadas = {_nombre_particion("resultados_busquedas", _mes(d)) for d in MESES_SEMBRADOS}
+    esperadas |= {
+        _nombre_particion("resultados_busquedas", _mes(d))
+        for d in range(PARTICIONES_MESES_FUTUROS + 1)
+    }
+    with engine_pg.connect() as conn:
+        for tabla in ("resultados_busquedas", "estados_rfi"):
+            assert esta_particionada(conn, tabla)
+            assert _contar(conn, tabla) == len(MESES_SEMBRADOS) * FILAS_POR_MES
+            assert _contar(conn, f"{tabla}_default") == 0
+            clave = conn.execute(
+                text(
+                    "SELECT array_agg(a.attname ORDER BY a.attname) FROM pg_constraint c"
+                    " JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY (c.conkey)"
+                    " WHERE c.conrelid = to_regclass(:tabla) AND c.contype = 'p'"
+                ),
+                {"tabla": tabla},
+            ).scalar_one()
+            assert clave == ["fecha", "id"]
+        assert set(listar_particiones(conn, "resultados_busquedas")) == esperadas | {
+            "resultados_busquedas_default"
+        }
+        for desplazamiento in MESES_SEMBRADOS:
+            particion = _nombre_particion("resultados_busquedas", _mes(desplazamiento))
+            assert _contar(conn, particion) == FILAS_POR_MES
+        assert conn.execute(text("SELECT count(*) FROM migrations")).scalar_one() == 1
+
+    # La numeración continúa donde la dejó la tabla original
+    with Session(engine_pg) as db:
+        assert _nuevo_resultado(db, datos, 0).id > maximos["resultados_busquedas"]
+        estado = EstadoRFI(rfi_id=datos["rfi"], estado="respondida", fecha=_fecha(0))
+        db.add(estado)
+        db.commit()
+        assert estado.id > maximos["estados_rfi"]
+
+    # Las claves foráneas se recrean, con su ON DELETE CASCADE
+    with Session(engine_pg) as db:
+        db.add(
+            ResultadoBusqueda(
+                proveedor_id=datos["proveedor"] + 1000,
+                tech_id=datos["tech"],
+                vt_id=datos["vt"],
+                fecha=_fecha(0),
+            )
+        )
+        with pytest.raises(IntegrityError):
+            db.commit()
+    with engine_pg.begin() as conn:
+        conn.execute(text("DELETE FROM vt WHERE id = :id"), {"id": datos["vt"]})
+        assert _contar(conn, "resultados_busquedas") == 0
+        assert _contar(conn, "estados_rfi") == 0
+
+    assert migrar(engine_pg) == []
+
+
+def test_migrar_columna_identity(engine_pg):
+    datos = _sembrar(engine_pg)
+    with engine_pg.begin() as conn:
+        maximo = _max_id(conn, "estados_rfi")
+        conn.execute(text("ALTER TABLE estados_rfi ALTER COLUMN id DROP DEFAULT"))
+        conn.execute(text("DROP SEQUENCE estados_rfi_id_seq"))
+        conn.execute(
+            text(
+                "ALTER TABLE estados_rfi ALTER COLUMN id"
+                f" ADD GENERATED BY DEFAULT AS IDENTITY (START WITH {maximo + 1})"
+            )
+        )
+    with engine_pg.begin() as conn:
+        assert migrar_tabla(conn, "estados_rfi")
+
+    with engine_pg.connect() as conn:
+        identidad = conn.execute(
+            text(
+                "SELECT attidentity FROM pg_attribute"
+                " WHERE attrelid = to_regclass('estados_rfi') AND attname = 'id'"
+            )
+        ).scalar_one()
+        assert identidad == ""
+        assert _contar(conn, "estados_rfi") == len(MESES_SEMBRADOS) * FILAS_POR_MES
+    with Session(engine_pg) as db:
+        estado = EstadoRFI(rfi_id=datos["rfi"], estado="respondida", fecha=_fecha(0))
+        db.add(estado)
+        db.commit()
+        assert estado.id == maximo + 1
+
+
+def test_crear_particion_traslada_filas_del_default(engine_pg):
+    datos = _migrado(engine_pg)
+    lejano = PARTICIONES_MESES_FUTUROS + 6
+    with Session(engine_pg) as db:
+        _nuevo_resultado(db, datos, lejano)
+    with engine_pg.begin() as conn:
+        assert _contar(conn, "resultados_busquedas_default") == 1
+        assert crear_particion(conn, "resultados_busquedas", _mes(lejano))
+        assert not crear_particion(conn, "resultados_busquedas", _mes(lejano))
+    with engine_pg.connect() as conn:
+        assert _contar(conn, "resultados_busquedas_default") == 0
+        assert _contar(conn, _nombre_particion("resultados_busquedas", _mes(lejano))) == 1
+
+
+def test_retencion_desadjunta_y_archiva_filas_tardias(engine_pg):
+    datos = _migrado(engine_pg)
+    # Fila tardía de un mes sin partición: cae en la partición por defecto
+    with Session(engine_pg) as db:
+        _nuevo_resultado(db, datos, -5)
+    with engine_pg.begin() as conn:
+        retiradas, borradas = aplicar_retencion(conn, "resultados_busquedas", 1, False)
+
+    expiradas = [_nombre_particion("resultados_busquedas", _mes(d)) for d in (-3, -2)]
+    tardia = _nombre_particion("resultados_busquedas", _mes(-5))
+    assert retiradas == expiradas + [tardia]
+    assert borradas == 0
+    with engine_pg.connect() as conn:
+        adjuntas = listar_particiones(conn, "resultados_busquedas")
+        assert not set(retiradas) & set(adjuntas)
+        assert _contar(conn, "resultados_busquedas") == 2 * FILAS_POR_MES
+        assert _contar(conn, "resultados_busquedas_default") == 0
+        for nombre in expiradas:
+            assert _contar(conn, nombre) == FILAS_POR_MES
+        assert _contar(conn, tardia) == 1
+
+
+def test_retencion_con_eliminar_borra_particiones_y_cuenta_filas(engine_pg):
+    datos = _migrado(engine_pg)
+    with Session(engine_pg) as db:
+        _nuevo_resultado(db, datos, -5)
+    with engine_pg.begin() as conn:
+        retiradas, borradas = aplicar_retencion(conn, "resultados_busquedas", 1, True)
+
+    assert retiradas == [_nombre_particion("resultados_busquedas", _mes(d)) for d in (-3, -2)]
+    assert borradas == 1
+    with engine_pg.connect() as conn:
+        for nombre in retiradas:
+            assert conn.execute(text("SELECT to_regclass(:t)"), {"t": nombre}).scalar() is None
+        assert _contar(conn, "resultados_busquedas") == 2 * FILAS_POR_MES
+
+
+def test_explicar_muestra_la_poda_de_particiones(engine_pg):
+    datos = _migrado(engine_pg)
+    desde = datetime.combine(_mes(0), datetime.min.time(), tzinfo=timezone.utc)
+    with Session(engine_pg) as db:
+        for tabla, variantes in _consultas(datos["vt"], desde).items():
+            antiguas = {_nombre_particion(tabla, _mes(d)) for d in (-3, -2, -1)}
+            acotada = explicar(db, variantes["acotada"])
+            completa = explicar(db, variantes["completa"])
+            assert not acotada["particiones"] & antiguas
+            assert _nombre_particion(tabla, _mes(0)) in acotada["particiones"]
+            assert antiguas <= completa["particiones"]